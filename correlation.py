@@ -0,0 +1,255 @@
+# correlation.py
+import os
+import numpy as np
+import pandas as pd
+
+# ----------------- 수익률 패널 구성 -----------------
+def build_return_panel(data):
+    """종목별 가격 데이터(dict)에서 일간 로그 수익률 패널(날짜 x 종목)을 만듭니다."""
+    closes = {}
+    for ticker, ticker_data in data.items():
+        try:
+            close = ticker_data['Close']
+            if isinstance(close, pd.DataFrame):
+                close = close.iloc[:, 0]
+            closes[ticker] = close
+        except (KeyError, IndexError, TypeError):
+            continue
+
+    if not closes:
+        return pd.DataFrame()
+
+    close_panel = pd.DataFrame(closes).sort_index()
+    close_panel = close_panel[~close_panel.index.duplicated(keep='last')]
+    close_panel = close_panel.where(close_panel > 0)
+    return np.log(close_panel).diff().iloc[1:]
+
+# ----------------- 증분 롤링 공분산 -----------------
+class RollingCovariance:
+    """최근 N일 수익률의 공분산 행렬을 링 버퍼와 누적합으로 증분 갱신합니다.
+
+    하루 갱신은 가장 오래된 행을 빼고 새 행을 더하는 랭크-1 업데이트 두 번(O(N²))이며,
+    부동소수점 오차 누적을 막기 위해 window 회마다 버퍼 전체로 누적합을 다시 계산합니다.
+    결측 수익률은 0으로 취급합니다.
+    """
+
+    def __init__(self, tickers=(), window=60):
+        self.window = int(window)
+        self.tickers = list(tickers)
+        n = len(self.tickers)
+        self.buffer = np.zeros((self.window, n))
+        self.dates = np.full(self.window, np.datetime64('NaT'), dtype='datetime64[ns]')
+        self.pos = 0
+        self.count = 0
+        self.sums = np.zeros(n)
+        self.cross = np.zeros((n, n))
+        self.updates_since_refresh = 0
+
+    @property
+    def last_date(self):
+        """버퍼에 반영된 마지막 날짜를 반환합니다. 비어 있으면 None."""
+        if self.count == 0:
+            return None
+        return pd.Timestamp(self.dates[(self.pos - 1) % self.window])
+
+    def update(self, date, row):
+        """하루치 수익률 벡터를 반영합니다."""
+        row = np.nan_to_num(np.asarray(row, dtype=float))
+        if self.count == self.window:
+            old = self.buffer[self.pos]
+            self.sums -= old
+            self.cross -= np.outer(old, old)
+        else:
+            self.count += 1
+
+        self.sums += row
+        self.cross += np.outer(row, row)
+        self.buffer[self.pos] = row
+        self.dates[self.pos] = np.datetime64(pd.Timestamp(date), 'ns')
+        self.pos = (self.pos + 1) % self.window
+
+        self.updates_since_refresh += 1
+        if self.updates_since_refresh >= self.window:
+            self._refresh()
+
+    def _refresh(self):
+        """버퍼 전체로 누적합과 교차곱을 다시 계산합니다."""
+        self.sums = self.buffer.sum(axis=0)
+        self.cross = self.buffer.T @ self.buffer
+        self.updates_since_refresh = 0
+
+    def _seed(self, returns):
+        """비어 있는 상태를 수익률 패널의 최근 window일로 한 번에 채웁니다."""
+        recent = returns.iloc[-self.window:]
+        k = len(recent)
+        self.buffer[:] = 0.0
+        self.buffer[:k] = np.nan_to_num(recent[self.tickers].to_numpy(dtype=float))
+        self.dates[:] = np.datetime64('NaT')
+        self.dates[:k] = recent.index.to_numpy(dtype='datetime64[ns]')
+        self.count = k
+        self.pos = k % self.window
+        self._refresh()
+
+    def _drop(self, tickers):
+        """유니버스에서 빠진 종목의 행/열을 제거합니다."""
+        drop = set(tickers)
+        keep = [i for i, t in enumerate(self.tickers) if t not in drop]
+        self.tickers = [self.tickers[i] for i in keep]
+        self.buffer = self.buffer[:, keep]
+        self.sums = self.sums[keep]
+        self.cross = self.cross[np.ix_(keep, keep)]
+
+    def _add(self, tickers, returns):
+        """새 종목을 버퍼에 있는 날짜의 수익률로 채우고 해당 행/열만 계산합니다."""
+        tickers = list(tickers)
+        new_cols = np.zeros((self.window, len(tickers)))
+        valid = ~np.isnat(self.dates)
+        if valid.any():
+            aligned = returns[tickers].reindex(pd.DatetimeIndex(self.dates[valid]))
+            new_cols[valid] = np.nan_to_num(aligned.to_numpy(dtype=float))
+
+        n_old = len(self.tickers)
+        cross_new = self.buffer.T @ new_cols
+        block_new = new_cols.T @ new_cols
+        cross = np.empty((n_old + len(tickers), n_old + len(tickers)))
+        cross[:n_old, :n_old] = self.cross
+        cross[:n_old, n_old:] = cross_new
+        cross[n_old:, :n_old] = cross_new.T
+        cross[n_old:, n_old:] = block_new
+
+        self.tickers += tickers
+        self.buffer = np.hstack([self.buffer, new_cols])
+        self.sums = np.concatenate([self.sums, new_cols.sum(axis=0)])
+        self.cross = cross
+
+    def sync(self, returns):
+        """수익률 패널에 맞춰 유니버스를 맞추고, 마지막 날짜 이후의 수익률만 반영합니다."""
+        if returns is None or returns.empty:
+            return self
+
+        columns = list(returns.columns)
+        removed = [t for t in self.tickers if t not in set(columns)]
+        if removed:
+            self._drop(removed)
+        known = set(self.tickers)
+        added = [t for t in columns if t not in known]
+
+        if self.count == 0:
+            self.tickers += added
+            n = len(self.tickers)
+            self.buffer = np.zeros((self.window, n))
+            self.sums = np.zeros(n)
+            self.cross = np.zeros((n, n))
+            self._seed(returns)
+            return self
+
+        if added:
+            self._add(added, returns)
+
+        last_date = self.last_date
+        new_rows = returns[returns.index > last_date] if last_date is not None else returns
+        if len(new_rows) >= self.window:
+            self._seed(returns)
+            return self
+
+        values = new_rows[self.tickers].to_numpy(dtype=float)
+        for date, row in zip(new_rows.index, values):
+            self.update(date, row)
+        return self
+
+    def covariance(self):
+        """표본 공분산 행렬을 반환합니다."""
+        if self.count < 2:
+            return np.zeros_like(self.cross)
+        mean = self.sums / self.count
+        return (self.cross - self.count * np.outer(mean, mean)) / (self.count - 1)
+
+    def correlation(self):
+        """상관계수 행렬을 반환합니다. 변동이 없는 종목은 자기 자신과만 1로 둡니다."""
+        cov = self.covariance()
+        std = np.sqrt(np.clip(np.diag(cov), 0, None))
+        denom = np.outer(std, std)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.where(denom > 0, cov / denom, 0.0)
+        corr = np.clip(corr, -1.0, 1.0)
+        np.fill_diagonal(corr, 1.0)
+        return corr
+
+    def clusters(self, threshold=0.7):
+        """구성 종목 모두와 상관계수가 threshold 이상인 종목끼리 묶은 클러스터 번호를 {티커: 번호}로 반환합니다."""
+        return correlation_clusters(self.correlation(), self.tickers, threshold)
+
+    # ----------------- 상태 저장/복원 -----------------
+    def save(self, file_path):
+        """현재 상태를 npz 파일로 저장합니다."""
+        try:
+            directory = os.path.dirname(file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            np.savez(
+                file_path,
+                tickers=np.array(self.tickers, dtype=str), window=self.window,
+                buffer=self.buffer, dates=self.dates.astype('int64'),
+                pos=self.pos, count=self.count, sums=self.sums, cross=self.cross,
+                updates_since_refresh=self.updates_since_refresh
+            )
+        except Exception as e:
+            print(f"⚠️ 상관관계 상태 저장 실패: {e}")
+
+    @classmethod
+    def load(cls, file_path, window=60):
+        """저장된 상태를 불러옵니다. 파일이 없거나 window가 다르면 빈 상태를 반환합니다."""
+        if not os.path.exists(file_path):
+            return cls(window=window)
+        try:
+            with np.load(file_path) as f:
+                if int(f['window']) != int(window):
+                    return cls(window=window)
+                model = cls(window=window)
+                model.tickers = [str(t) for t in f['tickers']]
+                model.buffer = f['buffer']
+                model.dates = f['dates'].astype('datetime64[ns]')
+                model.pos = int(f['pos'])
+                model.count = int(f['count'])
+                model.sums = f['sums']
+                model.cross = f['cross']
+                model.updates_since_refresh = int(f['updates_since_refresh'])
+                return model
+        except Exception as e:
+            print(f"⚠️ 상관관계 상태 로드 실패, 새로 계산합니다: {e}")
+            return cls(window=window)
+
+# ----------------- 상관관계 클러스터링 -----------------
+def correlation_clusters(corr, tickers, threshold=0.7):
+    """클러스터의 모든 종목과 상관계수가 threshold 이상일 때만 합류시키는 완전 연결 방식으로 클러스터 번호를 매깁니다.
+
+    a-b, b-c만 강하게 묶인 경우처럼 사슬로 이어져 클러스터가 한없이 커지는 것을 막습니다.
+    상관이 높은 상대가 많은 종목부터 처리하고, 합류 가능한 클러스터가 여럿이면 평균 상관이 가장 높은 곳에 넣습니다.
+    """
+    n = len(tickers)
+    if n == 0:
+        return {}
+
+    order = np.argsort(-(corr >= threshold).sum(axis=1), kind='stable')
+    labels = np.full(n, -1)
+    # 클러스터별로 각 종목과 구성 종목 사이의 최소/합계 상관계수를 누적
+    member_min = np.empty((n, n))
+    member_sum = np.empty((n, n))
+    sizes = np.zeros(n)
+    n_clusters = 0
+
+    for i in order:
+        eligible = np.flatnonzero(member_min[:n_clusters, i] >= threshold)
+        if eligible.size:
+            cluster = eligible[np.argmax(member_sum[eligible, i] / sizes[eligible])]
+            member_min[cluster] = np.minimum(member_min[cluster], corr[i])
+            member_sum[cluster] += corr[i]
+        else:
+            cluster = n_clusters
+            member_min[cluster] = corr[i]
+            member_sum[cluster] = corr[i]
+            n_clusters += 1
+        sizes[cluster] += 1
+        labels[i] = cluster
+
+    return {ticker: int(label) for ticker, label in zip(tickers, labels)}
@@ -0,0 +1,169 @@
+# data_quality.py
+import os
+import json
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+SPLIT_FIELD = 'Stock Splits'
+
+# 점검 항목과 리포트 표시용 설명
+CHECK_LABELS = {
+    'download_error': '다운로드 실패 (다음 실행 때 재시도)',
+    'insufficient_history': '가격 이력 부족 (200봉 미만)',
+    'duplicate_dates': '중복 날짜',
+    'stale_last_bar': '마지막 봉 지연',
+    'missing_bars': '결측 봉 과다',
+    'zero_volume': '거래량 0인 날',
+    'invalid_ohlc': 'OHLC 값 이상',
+    'split_jump': '미조정 분할',
+}
+
+# ----------------- 가격 패널 구성 -----------------
+def build_price_panel(data):
+    """종목별 데이터를 (날짜 x 종목 x OHLCV) 배열 하나로 합칩니다.
+
+    날짜 인덱스, 종목 목록, 가격 배열, (날짜 x 종목) 분할 비율 배열(분할이 없으면 0),
+    중복 날짜가 있던 종목 목록을 반환합니다.
+    """
+    frames = {}
+    duplicated = []
+    for ticker, ticker_data in data.items():
+        if not isinstance(ticker_data, pd.DataFrame) or ticker_data.empty:
+            continue
+        columns = ticker_data.columns
+        if isinstance(columns, pd.MultiIndex):
+            columns = columns.get_level_values(0)
+        field_pos = columns.get_indexer(PRICE_FIELDS + [SPLIT_FIELD])
+        if (field_pos[:-1] < 0).any():
+            continue
+        if ticker_data.index.duplicated().any():
+            duplicated.append(ticker)
+            ticker_data = ticker_data[~ticker_data.index.duplicated(keep='last')]
+        frames[ticker] = (ticker_data, field_pos)
+
+    if not frames:
+        return pd.DatetimeIndex([]), [], np.empty((0, 0, len(PRICE_FIELDS))), np.empty((0, 0)), duplicated
+
+    dates = next(iter(frames.values()))[0].index
+    for ticker_data, _ in frames.values():
+        if not ticker_data.index.equals(dates):
+            dates = dates.union(ticker_data.index)
+
+    # 대부분 종목은 같은 날짜 인덱스를 가지므로 reindex 없이 배열만 꺼냄
+    arrays = []
+    split_arrays = []
+    for ticker_data, field_pos in frames.values():
+        if not ticker_data.index.equals(dates):
+            ticker_data = ticker_data.reindex(dates)
+        values = ticker_data.to_numpy(dtype=float)
+        arrays.append(values[:, field_pos[:-1]])
+        split_arrays.append(values[:, field_pos[-1]] if field_pos[-1] >= 0 else np.zeros(len(dates)))
+    return dates, list(frames), np.stack(arrays, axis=1), np.nan_to_num(np.stack(split_arrays, axis=1)), duplicated
+
+# ----------------- 일괄 검증 -----------------
+def validate_price_data(data, keep=(), lookback=200, stale_days=0, max_missing_rate=0.05,
+                        zero_volume_window=20, ohlc_tolerance=0.01, split_window=5, split_tolerance=0.03):
+    """전체 가격 패널에 대해 품질 점검을 한 번에 수행합니다.
+
+    통과한 종목만 담은 data, {티커: [점검 항목]} 형태의 문제 목록,
+    점검 항목별 종목 수를 반환합니다. keep에 있는 종목(보유 종목)은
+    문제가 있어도 data에서 빼지 않고 문제 목록에만 기록합니다.
+    """
+    dates, tickers, panel, splits, duplicated = build_price_panel(data)
+    issues = {ticker: ['duplicate_dates'] for ticker in duplicated}
+    if not tickers:
+        return {}, issues, _count_issues(issues)
+
+    tickers = np.array(tickers, dtype=object)
+    recent = panel[-lookback:]
+    high, low, close, volume = (recent[:, :, PRICE_FIELDS.index(field)] for field in ['High', 'Low', 'Close', 'Volume'])
+    flags = {}
+
+    # 마지막 유효 봉이 전체 패널의 최신 날짜보다 stale_days 영업일 넘게 뒤처진 종목 (기본값 0: 한 세션만 뒤처져도 표시)
+    valid = ~np.isnan(panel[:, :, PRICE_FIELDS.index('Close')])
+    last_valid_pos = len(dates) - 1 - np.argmax(valid[::-1], axis=0)
+    last_valid_dates = dates.to_numpy(dtype='datetime64[D]')[last_valid_pos]
+    lag = np.busday_count(last_valid_dates, dates[-1].to_numpy().astype('datetime64[D]'))
+    flags['stale_last_bar'] = lag > stale_days
+
+    # 최근 구간 중 상장 이후의 결측 비율
+    listed = np.maximum.accumulate(~np.isnan(close), axis=0)
+    missing = np.isnan(close) & listed
+    listed_days = listed.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flags['missing_bars'] = np.where(listed_days > 0, missing.sum(axis=0) / listed_days, 1.0) > max_missing_rate
+
+    flags['zero_volume'] = (volume[-zero_volume_window:] == 0).any(axis=0)
+
+    with np.errstate(invalid='ignore'):
+        bad_ohlc = (
+            (high < low) |
+            (close > high * (1 + ohlc_tolerance)) |
+            (close < low * (1 - ohlc_tolerance)) |
+            (close <= 0)
+        )
+    flags['invalid_ohlc'] = bad_ohlc.any(axis=0)
+
+    # 최근 split_window개 봉 중 'Stock Splits'에 분할이 기록된 날 가격이 분할 비율만큼 튀었으면 미조정 분할로 판단
+    # (분할 기록이 없는 급락/급등은 실제 가격 변동으로 보고 걸러내지 않음)
+    tail_close = pd.DataFrame(close[-(split_window + 1):]).ffill().to_numpy()
+    split_ratio = splits[-split_window:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jump = np.abs(np.log(tail_close[1:] / tail_close[:-1]))[-split_window:]
+        expected = np.abs(np.log(np.where(split_ratio > 0, split_ratio, 1.0)))
+    flags['split_jump'] = np.nan_to_num((expected > 0) & (np.abs(jump - expected) < split_tolerance)).any(axis=0)
+
+    for check, mask in flags.items():
+        for ticker in tickers[mask]:
+            issues.setdefault(ticker, []).append(check)
+
+    keep = set(keep)
+    clean_data = {ticker: ticker_data for ticker, ticker_data in data.items() if ticker not in issues or ticker in keep}
+    return clean_data, issues, _count_issues(issues)
+
+def _count_issues(issues):
+    """점검 항목별 해당 종목 수를 셉니다."""
+    counts = {check: 0 for check in CHECK_LABELS}
+    for reasons in issues.values():
+        for reason in reasons:
+            counts[reason] = counts.get(reason, 0) + 1
+    return counts
+
+# ----------------- 격리(quarantine) 캐시 -----------------
+def load_quarantine(file_path):
+    """격리 캐시를 불러옵니다. 파일이 없거나 손상되면 빈 딕셔너리를 반환합니다."""
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ 격리 캐시 로드 실패, 새로 시작합니다: {e}")
+        return {}
+
+def save_quarantine(file_path, quarantine):
+    """격리 캐시를 저장합니다."""
+    try:
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(quarantine, f, ensure_ascii=False, indent=2, sort_keys=True)
+    except Exception as e:
+        print(f"⚠️ 격리 캐시 저장 실패: {e}")
+
+def active_quarantine(quarantine, today=None):
+    """기한이 지나지 않은 격리 항목만 반환합니다."""
+    today = (today or date.today()).isoformat()
+    return {ticker: entry for ticker, entry in quarantine.items() if entry.get('until', '') > today}
+
+def update_quarantine(quarantine, issues, days, today=None):
+    """문제가 발견된 종목을 사유와 함께 days일 동안 격리하고, 만료된 항목은 정리합니다."""
+    today = today or date.today()
+    quarantine = active_quarantine(quarantine, today)
+    until = (today + timedelta(days=days)).isoformat()
+    for ticker, reasons in issues.items():
+        quarantine[ticker] = {'reasons': list(reasons), 'since': today.isoformat(), 'until': until}
+    return quarantine
@@ -0,0 +1,190 @@
+# delivery.py
+import os
+import glob
+import time
+import queue
+import hashlib
+import smtplib
+from email import message_from_bytes
+from email.mime.text import MIMEText
+from email.utils import getaddresses, formataddr
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TEMPLATE_ENV = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']), trim_blocks=True, lstrip_blocks=True
+)
+# {{ value | number(',.0f') }} 처럼 파이썬 format 지정자로 숫자를 표시
+TEMPLATE_ENV.filters['number'] = format
+
+# ----------------- 리포트 섹션 렌더링 -----------------
+def render_template(template_name, **context):
+    """templates 폴더의 템플릿을 주어진 데이터로 렌더링해 HTML 문자열을 반환합니다."""
+    return TEMPLATE_ENV.get_template(template_name).render(**context)
+
+# ----------------- 수신자 및 리포트 렌더링 -----------------
+def parse_recipients(receiver_emails_str):
+    """'이름 <메일>, 메일' 형식의 문자열을 (이름, 메일) 목록으로 변환합니다."""
+    return [(name.strip(), addr.strip()) for name, addr in getaddresses([receiver_emails_str]) if addr.strip()]
+
+def render_messages(subject, body, sender_email, recipients, report_type, template_name='report_email.html'):
+    """수신자별 이메일을 만듭니다. 같은 내용의 변형은 한 번만 렌더링합니다."""
+    template = TEMPLATE_ENV.get_template(template_name)
+    body_clean = body.replace('\xa0', ' ')
+
+    rendered = {}
+    messages = []
+    for name, addr in recipients:
+        if name not in rendered:
+            rendered[name] = template.render(name=name, body=body_clean)
+        msg = MIMEText(rendered[name], 'html', _charset='utf-8')
+        msg['Subject'] = subject
+        msg['From'] = sender_email
+        msg['To'] = formataddr((name, addr))
+        msg['X-Report-Type'] = report_type
+        messages.append(msg)
+    return messages
+
+# ----------------- 아웃박스 (전송 대기함) -----------------
+class Outbox:
+    """전송할 메일을 .eml 파일로 보관하고, 전송에 성공하면 삭제합니다.
+
+    파일은 (리포트 종류, 수신자)마다 하나이므로 새 리포트가 같은 종류의 미전송 메일을 대체합니다.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, msg):
+        """메일의 리포트 종류와 수신자로 아웃박스 파일 경로를 정합니다."""
+        addresses = ','.join(sorted(addr.lower() for _, addr in getaddresses(msg.get_all('To', []))))
+        digest = hashlib.sha1(addresses.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.directory, f"{msg['X-Report-Type']}_{digest}.eml")
+
+    def put(self, msg):
+        """메일을 아웃박스에 저장하고 파일 경로를 반환합니다. 같은 종류의 미전송 메일은 덮어씁니다."""
+        file_path = self.path_for(msg)
+        if os.path.exists(file_path):
+            print(f"⚠️ 미전송 상태였던 이전 {msg['X-Report-Type']} 리포트를 새 리포트로 대체합니다: {msg['To']}")
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(msg.as_bytes())
+        os.replace(tmp_path, file_path)
+        return file_path
+
+    def pending(self):
+        """전송 대기 중인 파일 목록을 반환합니다."""
+        return sorted(glob.glob(os.path.join(self.directory, '*.eml')))
+
+    @staticmethod
+    def load(file_path):
+        """아웃박스 파일을 메일 객체로 읽습니다."""
+        with open(file_path, 'rb') as f:
+            return message_from_bytes(f.read())
+
+    @staticmethod
+    def done(file_path):
+        """전송이 끝난 파일을 삭제합니다."""
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+# ----------------- SMTP 연결 풀 -----------------
+class SMTPPool:
+    """로그인된 SMTP 연결을 재사용하는 연결 풀입니다."""
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=True, size=4, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def acquire(self):
+        """쉬고 있는 연결을 꺼내고, 없으면 새로 연결합니다."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, server):
+        if self._idle.qsize() < self.size:
+            self._idle.put(server)
+        else:
+            self.discard(server)
+
+    @staticmethod
+    def discard(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def send(self, msg):
+        """메일 한 통을 보냅니다. 실패한 연결은 풀에 돌려놓지 않습니다."""
+        server = self.acquire()
+        try:
+            recipients = [addr for _, addr in getaddresses(msg.get_all('To', []))]
+            server.sendmail(msg['From'], recipients, msg.as_string())
+        except Exception:
+            self.discard(server)
+            raise
+        self.release(server)
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+# ----------------- 전송 -----------------
+def _send_with_retry(pool, file_path, retries, backoff):
+    """아웃박스 파일 하나를 재시도하며 전송합니다."""
+    msg = Outbox.load(file_path)
+    for attempt in range(1, retries + 1):
+        try:
+            pool.send(msg)
+            Outbox.done(file_path)
+            return True
+        except Exception as e:
+            print(f"⚠️ {msg['To']} 전송 실패 ({attempt}/{retries}): {e}")
+            if attempt < retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    return False
+
+def deliver_outbox(outbox, pool, retries=3, backoff=1.0):
+    """아웃박스의 모든 메일을 연결 풀 크기만큼 동시에 전송하고 (성공, 실패) 건수를 반환합니다."""
+    files = outbox.pending()
+    if not files:
+        return 0, 0
+    try:
+        with ThreadPoolExecutor(max_workers=min(pool.size, len(files))) as executor:
+            results = list(executor.map(lambda f: _send_with_retry(pool, f, retries, backoff), files))
+    finally:
+        pool.close()
+    sent = sum(results)
+    return sent, len(results) - sent
+
+def deliver_report(subject, body, sender_email, receiver_emails_str, report_type, pool, outbox, **kwargs):
+    """리포트를 수신자별로 렌더링해 아웃박스에 저장한 뒤, 이전 미전송분과 함께 전송합니다."""
+    recipients = parse_recipients(receiver_emails_str)
+    for msg in render_messages(subject, body, sender_email, recipients, report_type):
+        outbox.put(msg)
+    return deliver_outbox(outbox, pool, **kwargs)
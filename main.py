@@ -1,8 +1,6 @@
 # main.py
 import yfinance as yf
 import pandas as pd
-import smtplib
-from email.mime.text import MIMEText
 import pandas_ta as ta
 import os
 import sys
@@ -11,6 +9,10 @@ from datetime import datetime
 import io
 import time
 import requests
+from correlation import RollingCovariance, build_return_panel
+from risk import simulate_portfolio_risk
+from delivery import SMTPPool, Outbox, deliver_report, render_template
+from data_quality import CHECK_LABELS, validate_price_data, load_quarantine, save_quarantine, active_quarantine, update_quarantine
 
 # ----------------- 설정값을 외부 파일에서 불러오기 -----------------
 def read_settings(file_path='settings.txt'):
@@ -40,7 +42,15 @@ def read_settings(file_path='settings.txt'):
             'ADX_THRESHOLD': int(settings.get('ADX_THRESHOLD', 20)),
             'ATR_UPPER_LIMIT': float(settings.get('ATR_UPPER_LIMIT', 3.0)),
             'SECTOR_LIMIT': int(settings.get('SECTOR_LIMIT', 3)),
-            'FORWARD_PER': float(settings.get('FORWARD_PER', 18.0))
+            'FORWARD_PER': float(settings.get('FORWARD_PER', 18.0)),
+            'CORR_WINDOW': int(settings.get('CORR_WINDOW', 60)),
+            'CORR_THRESHOLD': float(settings.get('CORR_THRESHOLD', 0.7)),
+            'CLUSTER_LIMIT': int(settings.get('CLUSTER_LIMIT', 2)),
+            'MAX_CORRELATED_UNITS': int(settings.get('MAX_CORRELATED_UNITS', 6)),
+            'RISK_PATHS': int(settings.get('RISK_PATHS', 20000)),
+            'RISK_HORIZON': int(settings.get('RISK_HORIZON', 20)),
+            'RISK_BLOCK_SIZE': int(settings.get('RISK_BLOCK_SIZE', 5)),
+            'QUARANTINE_DAYS': int(settings.get('QUARANTINE_DAYS', 5))
         }
     except ValueError as e:
         print(f"❌ 설정 파일의 값 형식이 올바르지 않습니다. 숫자형 값에 문제가 있습니다: {e}")
@@ -58,20 +68,39 @@ ADX_THRESHOLD = SETTINGS['ADX_THRESHOLD']
 ATR_UPPER_LIMIT = SETTINGS['ATR_UPPER_LIMIT']
 SECTOR_LIMIT = SETTINGS['SECTOR_LIMIT']
 FORWARD_PER = SETTINGS['FORWARD_PER']
+CORR_WINDOW = SETTINGS['CORR_WINDOW']
+CORR_THRESHOLD = SETTINGS['CORR_THRESHOLD']
+CLUSTER_LIMIT = SETTINGS['CLUSTER_LIMIT']
+MAX_CORRELATED_UNITS = SETTINGS['MAX_CORRELATED_UNITS']
+RISK_PATHS = SETTINGS['RISK_PATHS']
+RISK_HORIZON = SETTINGS['RISK_HORIZON']
+RISK_BLOCK_SIZE = SETTINGS['RISK_BLOCK_SIZE']
+QUARANTINE_DAYS = SETTINGS['QUARANTINE_DAYS']
 MAX_UNITS = 4
+CACHE_DIR = 'cache'
+CORR_STATE_PATH = os.path.join(CACHE_DIR, 'correlation_state.npz')
+QUARANTINE_PATH = os.path.join(CACHE_DIR, 'quarantine.json')
+OUTBOX_DIR = os.path.join(CACHE_DIR, 'outbox')
 
 # ----------------- 데이터 수집 함수 (yfinance 기반) -----------------
 def get_historical_data(ticker):
-    """yfinance를 사용하여 주식 과거 데이터를 가져옵니다."""
+    """yfinance를 사용하여 주식 과거 데이터를 가져옵니다.
+
+    (데이터, 실패 사유)를 반환합니다. 실패 사유는 성공 시 None, 200봉 미만이면
+    'insufficient_history'(영구적), 예외나 빈 응답이면 'download_error'(일시적)입니다.
+    """
     try:
         ticker_data = yf.download(ticker, period="2y", auto_adjust=True, progress=False, actions=True)
-        # 데이터프레임 유효성 검사를 더욱 강화
-        if isinstance(ticker_data, pd.DataFrame) and not ticker_data.empty and len(ticker_data) >= 200:
-            return ticker_data
-        return None
     except Exception as e:
         print(f"❌ {ticker} yfinance 다운로드 실패: {e}")
-        return None
+        return None, 'download_error'
+
+    # 빈 응답은 네트워크 오류나 요청 제한일 수 있으므로 일시적 실패로 봄
+    if not isinstance(ticker_data, pd.DataFrame) or ticker_data.empty:
+        return None, 'download_error'
+    if len(ticker_data) < 200:
+        return None, 'insufficient_history'
+    return ticker_data, None
 
 def get_realtime_data(ticker):
     """yfinance를 사용하여 실시간 데이터를 가져옵니다."""
@@ -213,9 +242,12 @@ def get_turtle_signal(ticker_data, vix_value, exchange_rate, dynamic_adx_thresho
         print(f"❌ 분석 중 오류: {e}")
         return "오류", {}
 
-# ----------------- 이메일 전송 함수 (기존 로직 유지) -----------------
-def send_email(subject, body):
-    """리포트를 이메일로 전송합니다."""
+# ----------------- 이메일 전송 함수 -----------------
+def send_email(subject, body, report_type):
+    """리포트를 수신자별로 렌더링해 연결 풀로 동시에 전송합니다.
+
+    실패분은 아웃박스에 남아 다음 실행 때 재전송되며, 같은 report_type의 새 리포트가 나오면 그것으로 대체됩니다.
+    """
     sender_email = os.getenv("SENDER_EMAIL")
     sender_password = os.getenv("GMAIL_APP_PASSWORD")
     receiver_emails_str = os.getenv("RECEIVER_EMAIL")
@@ -224,20 +256,20 @@ def send_email(subject, body):
     if not all([sender_email, sender_password, receiver_emails_str]):
         print("❌ 이메일 설정이 누락되었습니다. Secrets를 확인하세요.")
         return
-        
-    receiver_emails = [email.strip() for email in receiver_emails_str.split(',')]
 
-    body_clean = body.replace('\xa0', ' ').replace('\u00A0', ' ')
-    msg = MIMEText(body_clean, 'html', _charset='utf-8')
-    msg['Subject'] = subject
-    msg['From'] = sender_email
-    msg['To'] = receiver_emails_str
+    # SMTP_HOST/SMTP_PORT/SMTP_USE_SSL로 로컬 테스트용 SMTP 서버를 지정할 수 있음
+    pool = SMTPPool(
+        os.getenv("SMTP_HOST", "smtp.gmail.com"), int(os.getenv("SMTP_PORT", 465)),
+        username=sender_email, password=sender_password,
+        use_ssl=os.getenv("SMTP_USE_SSL", "1") != "0", size=int(os.getenv("SMTP_POOL_SIZE", 10))
+    )
 
     try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, receiver_emails, msg.as_string())
-        print("✅ 이메일이 성공적으로 전송되었습니다.")
+        sent, failed = deliver_report(subject, body, sender_email, receiver_emails_str, report_type, pool, Outbox(OUTBOX_DIR))
+        if failed:
+            print(f"❌ 이메일 {failed}건 전송 실패 (성공 {sent}건). 아웃박스에 남겨 다음 실행 때 재전송합니다.")
+        else:
+            print(f"✅ 이메일 {sent}건이 성공적으로 전송되었습니다.")
     except Exception as e:
         print(f"❌ 이메일 전송 실패: {e}")
 
@@ -319,6 +351,9 @@ def generate_detailed_stock_report_html(s, action, indicators):
     elif action == '보유':
         target_stop_html = f"→ <b>현재 보유 수량</b>: {s['units']}주 (추세 유지 중)<br>→ 손절가: ${indicators['손절가_usd']:.2f}"
 
+    if s.get('data_warning'):
+        target_stop_html += f"<br>→ ⚠️ <b>데이터 이상</b>: {s['data_warning']} (가격 데이터를 직접 확인하세요)"
+
     return f"""
     <li>
         <b>{s['ticker']}</b> ({s['sector']}): {action}
@@ -377,30 +412,76 @@ if __name__ == '__main__':
     positions_dict = {row['ticker']: row for _, row in positions_df.iterrows()}
     
     data = {}
-    failed_tickers = []
+    failed_tickers = {}
     print(f"📊 총 {len(all_tickers)}개 종목 데이터 다운로드 중...")
     
     all_target_tickers = list(set(all_tickers + list(positions_dict.keys())))
 
+    # 격리 기간 중인 종목은 다시 받지 않음 (보유 종목은 항상 확인)
+    quarantine = load_quarantine(QUARANTINE_PATH)
+    skipped_tickers = {t: entry for t, entry in active_quarantine(quarantine).items() if t in all_target_tickers and t not in positions_dict}
+    if skipped_tickers:
+        print(f"🚧 격리 중인 {len(skipped_tickers)}개 종목은 다운로드를 건너뜁니다.")
+        all_target_tickers = [t for t in all_target_tickers if t not in skipped_tickers]
+
     for i, ticker in enumerate(all_target_tickers):
         print(f"({i+1}/{len(all_target_tickers)}) 다운로드 중: {ticker}")
-        ticker_data = get_historical_data(ticker)
-        if ticker_data is not None and not ticker_data.empty and len(ticker_data) >= 200:
+        ticker_data, error = get_historical_data(ticker)
+        if error is None:
             data[ticker] = ticker_data
         else:
-            failed_tickers.append(ticker)
+            failed_tickers[ticker] = error
         
         # IP 차단을 막기 위해 요청 간에 딜레이 추가
         time.sleep(5)
 
     print(f"✅ 성공: {len(data)}개, ❌ 실패: {len(failed_tickers)}개")
 
+    # 전체 가격 패널 일괄 품질 점검 후 문제 종목은 사유와 함께 격리
+    # 보유 종목은 매도 신호를 놓치지 않도록 분석에서 빼지 않고 경고만 붙임
+    start_time = time.time()
+    data, dq_issues, dq_counts = validate_price_data(data, keep=positions_dict.keys())
+    for ticker, error in failed_tickers.items():
+        dq_issues[ticker] = [error]
+        dq_counts[error] += 1
+    held_issues = {t: reasons for t, reasons in dq_issues.items() if t in positions_dict}
+    held_warnings = {t: ', '.join(CHECK_LABELS.get(r, r) for r in reasons) for t, reasons in held_issues.items()}
+    # 일시적 다운로드 실패는 다음 실행 때 다시 받도록 격리하지 않음
+    quarantined_issues = {t: reasons for t, reasons in dq_issues.items() if t not in positions_dict and reasons != ['download_error']}
+    quarantine = update_quarantine(quarantine, quarantined_issues, QUARANTINE_DAYS)
+    save_quarantine(QUARANTINE_PATH, quarantine)
+    # 다운로드에 실패한 보유 종목은 data에 없으므로 data에 남은 경고 종목만 빼서 통과 수를 계산
+    dq_passed = len(data) - sum(t in data for t in held_issues)
+    print(f"🧹 데이터 품질 점검: 통과 {dq_passed}개, 격리 {len(quarantined_issues)}개, 보유 종목 경고 {len(held_issues)}개 ({time.time() - start_time:.2f}초)")
+
+    # 롤링 상관관계 행렬을 증분 갱신하고 상관 클러스터를 구함
+    corr_model = RollingCovariance.load(CORR_STATE_PATH, CORR_WINDOW)
+    returns_panel = build_return_panel(data)
+    corr_model.sync(returns_panel)
+    corr_model.save(CORR_STATE_PATH)
+    clusters = corr_model.clusters(CORR_THRESHOLD)
+    cluster_sizes = pd.Series(clusters, dtype=int).value_counts()
+    largest_cluster = int(cluster_sizes.max()) if not cluster_sizes.empty else 0
+    print(f"🔗 상관 클러스터: {len(cluster_sizes)}개 (종목 {len(clusters)}개, 최대 클러스터 {largest_cluster}개 종목, 기준 {CORR_THRESHOLD})")
+
     a_plus_plus_list = []
     pyramid_signals = []
     sell_signals = []
     sector_counts = {}
+    cluster_counts = {}
+    cluster_units = {}
+    risk_positions = []
+    risk_exited_tickers = []
+    # 유닛 수가 MAX_UNITS를 넘으면 MAX_UNITS로 계산하되 주식 수로 입력된 것은 아닌지 경고
+    oversized_units = {ticker: int(position['units']) for ticker, position in positions_dict.items() if int(position['units']) > MAX_UNITS}
+    if oversized_units:
+        print(f"⚠️ positions.csv의 units가 최대 {MAX_UNITS}유닛을 초과합니다 (주식 수로 입력되었는지 확인 필요): "
+              + ", ".join(f"{t}={u}" for t, u in oversized_units.items()))
+    for ticker, position in positions_dict.items():
+        if ticker in clusters:
+            cluster_units[clusters[ticker]] = cluster_units.get(clusters[ticker], 0) + min(int(position['units']), MAX_UNITS)
     
-    def is_a_plus_plus(ind, price_data, sector_name):
+    def is_a_plus_plus(ind, price_data, sector_name, cluster_id=None):
         try:
             last_atr = price_data['ATR'].iloc[-1]
             avg_atr_20d = price_data['ATR'].rolling(window=20).mean().iloc[-1]
@@ -412,6 +493,9 @@ if __name__ == '__main__':
         
         if sector_counts.get(sector_name, 0) >= SECTOR_LIMIT:
             return False
+
+        if cluster_id is not None and (cluster_counts.get(cluster_id, 0) >= CLUSTER_LIMIT or cluster_units.get(cluster_id, 0) >= MAX_CORRELATED_UNITS):
+            return False
             
         return (
             ind['ADX'] > ADX_THRESHOLD and
@@ -439,35 +523,60 @@ if __name__ == '__main__':
                 continue
 
             if is_holding:
+                # 보유 유닛 x 1유닛 수량(2N 기준)으로 리스크 시뮬레이션용 포지션 구성
+                # SELL 신호 종목은 오늘 종가로 청산된 것으로 보고 시뮬레이션에서 제외
+                if signal == "SELL":
+                    risk_exited_tickers.append(ticker)
+                else:
+                    risk_positions.append({
+                        'ticker': ticker, 'quantity': ind['매수가능수량'] * min(int(units), MAX_UNITS),
+                        'price': ind['종가'], 'stop': ind['손절가_usd']
+                    })
                 if signal == "PYRAMID_BUY":
                     pyramid_signals.append({
                         'ticker': ticker, 'close': ind['종가'], 'close_krw': ind['종가_krw'], 'pyramid_price_krw': ind['추가매수가_usd'] * EXCHANGE_RATE_KRW_USD,
                         'units': units, 'sector': sector, 'atr': ind['ATR'], 'atr_ratio': ind['ATR비율'],
-                        'ma200': ind['MA200'], '괴리율': ind['괴리율'], 'adx': ind['ADX'], '+di': ind['+DI'], '-di': ind['DMN_14']
+                        'ma200': ind['MA200'], '괴리율': ind['괴리율'], 'adx': ind['ADX'], '+di': ind['+DI'], '-di': ind['DMN_14'],
+                        'data_warning': held_warnings.get(ticker)
                     })
                 elif signal == "SELL":
                     sell_signals.append({
                         'ticker': ticker, 'close': ind['종가'], 'close_krw': ind['종가_krw'], 'stop_price_krw': ind['손절가_usd'] * EXCHANGE_RATE_KRW_USD,
                         'units': units, 'sector': sector, 'atr': ind['ATR'], 'atr_ratio': ind['ATR비율'],
-                        'ma200': ind['MA200'], '괴리율': ind['괴리율'], 'adx': ind['ADX'], '+di': ind['+DI'], '-di': ind['DMN_14']
+                        'ma200': ind['MA200'], '괴리율': ind['괴리율'], 'adx': ind['ADX'], '+di': ind['+DI'], '-di': ind['DMN_14'],
+                        'data_warning': held_warnings.get(ticker)
                     })
             
-            if signal == "BUY" and is_a_plus_plus(ind, price_data, sector) and not is_holding:
+            cluster_id = clusters.get(ticker)
+            if signal == "BUY" and is_a_plus_plus(ind, price_data, sector, cluster_id) and not is_holding:
                 a_plus_plus_list.append({
                     'ticker': ticker, 'close': ind['종가'], 'close_krw': ind['종가_krw'],
                     'volume_krw': ind['volume_krw_billion'], 'ATR비율': ind['ATR비율'],
                     'target': ind.get('목표가_usd', 0), 'stop': ind.get('손절가_usd', 0),
                     'target_krw': ind.get('목표가', 0), 'stop_krw': ind.get('손절가', 0),
                     'quantity': ind.get('매수가능수량', 0), '거래량비율': ind['거래량비율'], 'RSI': ind['RSI'],
-                    'sector': sector, 'industry': industry,
+                    'sector': sector, 'industry': industry, 'cluster': cluster_id,
                     'atr': ind['ATR'], 'ma200': ind['MA200'], '괴리율': ind['괴리율'], 'adx': ind['ADX'], '+di': ind['+DI'], '-di': ind['DMN_14']
                 })
                 sector_counts[sector] = sector_counts.get(sector, 0) + 1
+                if cluster_id is not None:
+                    cluster_counts[cluster_id] = cluster_counts.get(cluster_id, 0) + 1
+                    cluster_units[cluster_id] = cluster_units.get(cluster_id, 0) + 1
         except Exception as e:
             print(f"⚠️ 분석 중 오류: {e}")
             continue
 
     a_plus_plus_list = sorted(a_plus_plus_list, key=lambda x: x['ATR비율'])
+
+    # 보유 종목 + A++ 신규 진입을 합친 포트폴리오 리스크 시뮬레이션
+    risk_positions += [{'ticker': s['ticker'], 'quantity': s['quantity'], 'price': s['close'], 'stop': s['stop']} for s in a_plus_plus_list]
+    start_time = time.time()
+    risk_result = simulate_portfolio_risk(
+        returns_panel, risk_positions, EXCHANGE_RATE_KRW_USD, TOTAL_SEED_KRW, MAX_LOSS_RATE,
+        n_paths=RISK_PATHS, horizon=RISK_HORIZON, block_size=RISK_BLOCK_SIZE
+    )
+    if risk_result is not None:
+        print(f"🎲 포트폴리오 리스크 시뮬레이션 완료: {RISK_PATHS:,}개 경로, {time.time() - start_time:.1f}초")
     
     backtest_results = {}
     for ticker_data in a_plus_plus_list:
@@ -554,7 +663,7 @@ ATR 비율 1~3% 양호, 3% 이상 고변동성
 
     disparity_sp500 = 0
     try:
-        sp500_data = get_historical_data('SPY') 
+        sp500_data, _ = get_historical_data('SPY')
         if sp500_data is not None and isinstance(sp500_data, pd.DataFrame) and not sp500_data.empty and len(sp500_data) >= 200 and 'Close' in sp500_data.columns:
             sp500_close = sp500_data['Close'].iloc[-1]
             sp500_ma200 = sp500_data['Close'].rolling(200).mean().iloc[-1]
@@ -665,6 +774,21 @@ ATR 비율 1~3% 양호, 3% 이상 고변동성
         report_body += "</ul><hr><br/>"
     else:
         report_body += "<h2>🌟 나만의 A++ 추천 종목</h2><p>현재 기준에 맞는 A++ 종목이 없습니다.</p><hr><br/>"
+
+    # 보유 종목과 A++ 후보 중 같은 상관 클러스터에 묶인 종목 표시
+    cluster_members = {}
+    for ticker in list(positions_dict.keys()) + [s['ticker'] for s in a_plus_plus_list]:
+        if ticker in clusters:
+            cluster_members.setdefault(clusters[ticker], []).append(ticker)
+    correlated_groups = [
+        {'members': members, 'units': cluster_units.get(cluster_id, 0)}
+        for cluster_id, members in cluster_members.items() if len(members) > 1
+    ]
+    if correlated_groups:
+        report_body += render_template(
+            'cluster_section.html', groups=correlated_groups, window=CORR_WINDOW,
+            threshold=CORR_THRESHOLD, max_units=MAX_CORRELATED_UNITS
+        )
         
     backtest_results = {}
     for ticker_data in a_plus_plus_list:
@@ -686,6 +810,18 @@ ATR 비율 1~3% 양호, 3% 이상 고변동성
         report_body += "</table>"
     else:
         report_body += "<h2>📊 전략 백테스팅 결과 (지난 1년)</h2><p>A++ 종목이 없거나 데이터 부족으로 백테스팅을 실행할 수 없습니다。</p>"
-    
-    send_email(subject, report_body)
+
+    report_body += render_template(
+        'data_quality_section.html', labels=CHECK_LABELS, counts=dq_counts, held_warnings=held_warnings,
+        passed=dq_passed, quarantined=len(quarantined_issues),
+        skipped=len(skipped_tickers), quarantine_days=QUARANTINE_DAYS
+    )
+
+    if risk_result is not None:
+        report_body += render_template(
+            'risk_section.html', risk=risk_result, max_loss_rate=MAX_LOSS_RATE,
+            max_units=MAX_UNITS, oversized_units=oversized_units, exited_tickers=risk_exited_tickers
+        )
+
+    send_email(subject, report_body, REPORT_TYPE)
     print("✅ 리포트 생성 및 전송 완료!")
@@ -0,0 +1,106 @@
+# risk.py
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# ----------------- 경로 생성 -----------------
+def _sample_returns(returns, n_paths, horizon, block_size, method, rng):
+    """과거 수익률 행렬(T x K)에서 (경로 x 기간 x 종목) 수익률을 만듭니다."""
+    T, K = returns.shape
+    if method == 'normal':
+        mean = returns.mean(axis=0)
+        cov = np.cov(returns, rowvar=False).reshape(K, K)
+        chol = np.linalg.cholesky(cov + np.eye(K) * 1e-12)
+        shocks = rng.standard_normal((n_paths, horizon, K))
+        return mean + shocks @ chol.T
+
+    # 블록 부트스트랩: 종목 간 상관과 짧은 자기상관을 함께 보존
+    block_size = max(1, min(block_size, T))
+    n_blocks = -(-horizon // block_size)
+    starts = rng.integers(0, T - block_size + 1, size=(n_paths, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block_size)).reshape(n_paths, -1)[:, :horizon]
+    return returns[idx]
+
+def _simulate_chunk(args):
+    """한 묶음의 경로를 시뮬레이션해 경로별 최종 손익, 최저 손익, 최대 낙폭(KRW)을 반환합니다."""
+    returns, prices, quantities, stops, exchange_rate, seed_krw, n_paths, horizon, block_size, method, seed = args
+    rng = np.random.default_rng(seed)
+
+    sampled = _sample_returns(returns, n_paths, horizon, block_size, method, rng)
+    price_paths = prices * np.exp(np.cumsum(sampled, axis=1))
+
+    # 2N 손절가 이탈 시 그날 종가로 청산하고 이후 가격을 고정
+    hit = np.maximum.accumulate(price_paths <= stops, axis=1)
+    first_hit = np.argmax(hit, axis=1)
+    exit_price = np.take_along_axis(price_paths, first_hit[:, None, :], axis=1)
+    price_paths = np.where(hit, exit_price, price_paths)
+
+    pnl = ((price_paths - prices) * quantities).sum(axis=2) * exchange_rate
+    equity = seed_krw + np.concatenate([np.zeros((n_paths, 1)), pnl], axis=1)
+    drawdown = np.maximum.accumulate(equity, axis=1) - equity
+
+    return pnl[:, -1], pnl.min(axis=1), drawdown.max(axis=1)
+
+# ----------------- 포트폴리오 리스크 시뮬레이션 -----------------
+def simulate_portfolio_risk(returns, positions, exchange_rate, seed_krw, max_loss_rate,
+                            n_paths=20000, horizon=20, block_size=5, method='bootstrap',
+                            workers=None, random_state=None):
+    """보유 종목과 신규 진입 후보의 포트폴리오 손익 분포를 시뮬레이션합니다.
+
+    returns는 날짜 x 종목의 일간 로그 수익률 DataFrame이고, positions는
+    {'ticker', 'quantity', 'price', 'stop'}(USD) 딕셔너리 목록입니다.
+    VaR/CVaR, 최대 손실 한도 도달 확률, 최대 낙폭 분포를 KRW 기준으로 반환합니다.
+    """
+    positions = [p for p in positions if p['ticker'] in returns.columns and p['quantity'] > 0]
+    if not positions or len(returns) < block_size + 1:
+        return None
+
+    tickers = [p['ticker'] for p in positions]
+    hist = np.nan_to_num(returns[tickers].to_numpy(dtype=float))
+    prices = np.array([p['price'] for p in positions], dtype=float)
+    quantities = np.array([p['quantity'] for p in positions], dtype=float)
+    stops = np.array([p['stop'] for p in positions], dtype=float)
+
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, n_paths // 1000 or 1))
+    chunk_sizes = [n_paths // workers + (1 if i < n_paths % workers else 0) for i in range(workers)]
+    seeds = np.random.SeedSequence(random_state).spawn(workers)
+    tasks = [
+        (hist, prices, quantities, stops, exchange_rate, seed_krw, size, horizon, block_size, method, seed)
+        for size, seed in zip(chunk_sizes, seeds)
+    ]
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_simulate_chunk, tasks))
+        except Exception as e:
+            print(f"⚠️ 병렬 리스크 시뮬레이션 실패, 단일 프로세스로 실행합니다: {e}")
+            results = [_simulate_chunk(task) for task in tasks]
+    else:
+        results = [_simulate_chunk(task) for task in tasks]
+
+    final_pnl = np.concatenate([r[0] for r in results])
+    min_pnl = np.concatenate([r[1] for r in results])
+    max_drawdown = np.concatenate([r[2] for r in results])
+
+    def var_cvar(level):
+        cutoff = np.percentile(final_pnl, (1 - level) * 100)
+        tail = final_pnl[final_pnl <= cutoff]
+        return -cutoff, -tail.mean() if tail.size else -cutoff
+
+    var95, cvar95 = var_cvar(0.95)
+    var99, cvar99 = var_cvar(0.99)
+    loss_limit_krw = seed_krw * max_loss_rate
+
+    return {
+        'paths': n_paths, 'horizon': horizon, 'positions': len(positions),
+        'exposure_krw': float((prices * quantities).sum() * exchange_rate),
+        'stop_risk_krw': float((np.clip(prices - stops, 0, None) * quantities).sum() * exchange_rate),
+        'expected_pnl_krw': float(final_pnl.mean()),
+        'var95_krw': float(var95), 'cvar95_krw': float(cvar95),
+        'var99_krw': float(var99), 'cvar99_krw': float(cvar99),
+        'loss_limit_krw': float(loss_limit_krw),
+        'prob_loss_limit': float((min_pnl <= -loss_limit_krw).mean()),
+        'mdd_krw': {q: float(np.percentile(max_drawdown, q)) for q in (50, 95, 99)},
+    }